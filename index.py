@@ -10,37 +10,279 @@ File Read & Write Challenge + Error Handling Lab
 - Handles FileNotFoundError, PermissionError, UnicodeDecodeError, IsADirectoryError, etc.
 """
 
+import argparse
+import codecs
+import concurrent.futures
+import contextlib
+import errno
+import io
+import json
+import itertools
+import multiprocessing
 import os
+import re
 import sys
 import tempfile
 import shutil
+import stat
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Block size used for binary fast paths and file buffers (1 MiB)
+BLOCK_SIZE = 1 << 20
+
+# In interactive runs, inputs at least this large (256 MiB) are split across worker
+# processes on the block path, for the transforms that are not cheap
+PARALLEL_THRESHOLD = 256 << 20
+
+# Text output is collected into batches of about this many characters before writing
+WRITE_BATCH_SIZE = 256 << 10
+
+# How much of the file is read to detect its encoding
+PROBE_SIZE = 4096
+
+# Byte-order marks, longest first (the UTF-32 LE mark starts with the UTF-16 LE one)
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+# Encodings where ASCII bytes always mean ASCII characters, so byte-level
+# transforms on complete lines are safe
+ASCII_COMPATIBLE_ENCODINGS = ("utf-8", "utf-8-sig", "cp1252", "latin-1")
+
+# 256-entry translation tables for ASCII case conversion
+_UPPER_TABLE = bytes.maketrans(bytes(range(0x61, 0x7b)), bytes(range(0x41, 0x5b)))
+_LOWER_TABLE = bytes.maketrans(bytes(range(0x41, 0x5b)), bytes(range(0x61, 0x7b)))
+
+# Whitespace-only lines (same characters str.strip() removes); \Z catches a blank last line
+_BLANK_LINE_BYTES = re.compile(rb"(?m)^[ \t\r\x0b\x0c\x1c-\x1f]*(?:\n|\Z)")
+_BLANK_LINE_TEXT = re.compile(r"(?m)^[^\S\n]*(?:\n|\Z)")
+
+# Whether anonymous temp files can be created and later linked by name
+# (Linux O_TMPFILE plus /proc/self/fd)
+_o_tmpfile_usable = hasattr(os, "O_TMPFILE") and os.path.isdir("/proc/self/fd")
+
+# Per output directory: whether such a file can actually be created and linked there
+_o_tmpfile_dirs = {}
+
+# Cache entries not used for this long (30 days) are dropped
+CACHE_TTL = 30 * 24 * 3600
+
+# Runs encoding detection in the background while the user answers prompts
+_DETECT_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
 # ---------- Helpers ----------
 
 def choose_encoding_try(filename, encodings=("utf-8", "cp1252", "latin-1")):
     """
-    Try to open the file using a list of encodings.
+    Detect the file encoding from a single read of its first PROBE_SIZE bytes.
+    Returns the encoding that worked, or raises UnicodeDecodeError if none worked.
+    """
+    with open(filename, "rb") as f:
+        head = f.read(PROBE_SIZE)
+    return detect_encoding(head, encodings)
+
+
+def detect_file_encoding(src, encodings=("utf-8", "cp1252", "latin-1")):
+    """
+    Like choose_encoding_try, but for an already-open binary file.
+    The read does not move src's position, so it may run in another thread.
+    """
+    return detect_encoding(read_head(src), encodings)
+
+
+def read_head(src):
+    """
+    Return the first PROBE_SIZE bytes of binary file src without moving its position.
+    """
+    if hasattr(os, "pread"):
+        return os.pread(src.fileno(), PROBE_SIZE, 0)
+    pos = src.tell()
+    src.seek(0)
+    head = src.read(PROBE_SIZE)
+    src.seek(pos)
+    return head
+
+
+def has_bare_cr(head):
+    """
+    Whether the start of a file (bytes) contains a carriage return that is not part
+    of a CRLF, i.e. old Mac-style line endings, which only the text paths (universal
+    newlines) treat as line breaks.
+    """
+    if len(head) == PROBE_SIZE and head.endswith(b"\r"):
+        # its LF may just be past the end of the probe
+        head = head[:-1]
+    return head.count(b"\r") != head.count(b"\r\n")
+
+
+def block_has_bare_cr(block, next_byte=b""):
+    """
+    Like has_bare_cr, for a block in the middle of a file. next_byte is the byte that
+    follows the block (b"" at the end of the file or after a newline), which decides
+    whether a CR at the very end of the block is part of a CRLF.
+    """
+    if b"\r" not in block:
+        return False
+    crlf = block.count(b"\r\n")
+    if next_byte == b"\n" and block.endswith(b"\r"):
+        crlf += 1
+    return block.count(b"\r") != crlf
+
+
+class BareCarriageReturn(Exception):
+    """
+    Raised by the binary block paths, which split lines on LF only, when they find a
+    CR line ending past the probe; the caller starts again on the text path.
+    """
+
+
+def detect_encoding(head, encodings=("utf-8", "cp1252", "latin-1")):
+    """
+    Detect the encoding of the start of a file (bytes).
+    A byte-order mark or pure ASCII decides immediately; otherwise each encoding is
+    tried on head with a plain decode, so exceptions are only raised for real failures.
     Returns the encoding that worked, or raises UnicodeDecodeError if none worked.
     """
+    for bom, enc in BOM_ENCODINGS:
+        if head.startswith(bom):
+            return enc
+
+    # Pure ASCII decodes identically under any ASCII-compatible candidate
+    if head.isascii() and encodings and encodings[0] in ASCII_COMPATIBLE_ENCODINGS:
+        return encodings[0]
+
     for enc in encodings:
         try:
-            with open(filename, "r", encoding=enc) as f:
-                # Try to read a small chunk to validate decoding
-                f.readline()
+            head.decode(enc)
             return enc
-        except UnicodeDecodeError:
-            continue
-        except Exception:
-            # For other exceptions (permission, isdir), re-raise so caller handles them
-            raise
+        except UnicodeDecodeError as e:
+            # a multi-byte character cut off by the end of a full probe is not an error
+            if len(head) == PROBE_SIZE and e.reason == "unexpected end of data":
+                return enc
     # if none succeeded
     raise UnicodeDecodeError("unknown", b"", 0, 1, "Unable to decode using tried encodings")
 
 
-def prompt_input_file():
+def cache_path():
+    """
+    Location of the per-file cache (encoding and last output of recently processed inputs).
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_dir, "fileproc.json")
+
+
+def load_cache():
+    """
+    Load the per-file cache, dropping entries not used within CACHE_TTL.
+    Returns an empty dict if there is no usable cache.
+    """
+    try:
+        with open(cache_path(), "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    cutoff = time.time() - CACHE_TTL
+    return {key: entry for key, entry in cache.items()
+            if isinstance(entry, dict) and entry.get("used", 0) >= cutoff}
+
+
+def save_cache(cache):
+    """
+    Atomically replace the cache file. Errors are ignored, the cache is only a shortcut.
+    """
+    path = cache_path()
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_name, _ = write_temp_file(cache_dir, lambda tmp: json.dump(cache, tmp), "w", "utf-8")
+    except OSError:
+        return
+    try:
+        os.replace(tmp_name, path)
+    except OSError:
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+
+
+def lookup_cache(cache, fname, st):
+    """
+    Return the cache entry for fname if the file is unchanged since the entry was
+    stored (same mtime and size as stat result st), else None.
+    """
+    entry = cache.get(os.path.abspath(fname))
+    if entry is None:
+        return None
+    if entry.get("mtime") == st.st_mtime_ns and entry.get("size") == st.st_size:
+        return entry
+    return None
+
+
+def update_cache(cache, fname, st, encoding, output_path):
+    """
+    Record the encoding and output path of a successfully processed file (stat result st).
+    encoding may be None (plain copy), in which case a still-valid cached encoding is kept.
+    """
+    if encoding is None:
+        old = lookup_cache(cache, fname, st)
+        encoding = old.get("encoding") if old else None
+    cache[os.path.abspath(fname)] = {
+        "mtime": st.st_mtime_ns,
+        "size": st.st_size,
+        "encoding": encoding,
+        "last_out": os.path.abspath(output_path),
+        "used": time.time(),
+    }
+
+
+def open_input_file(fname, cache=None, encoding=None):
+    """
+    Open fname for processing with a single stat and a single open.
+    Returns (src, future, cache_entry); raises OSError (e.g. FileNotFoundError,
+    PermissionError, IsADirectoryError) if the file cannot be used. Only regular files
+    are accepted, since processing seeks in and re-reads the input.
+    src is the file opened in binary mode, to be reused for processing (the caller
+    closes it). The future resolves to the encoding: the given encoding if any, else
+    a cached one for the unchanged file, else the result of detection, which runs in the
+    background so slow storage does not hold up the next prompt (as choose_encoding_try).
+    cache_entry is the cache entry for the unchanged file, or None.
+    """
+    st = os.stat(fname)
+    if stat.S_ISDIR(st.st_mode):
+        raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), fname)
+    if not stat.S_ISREG(st.st_mode):
+        # e.g. a FIFO or device, which cannot be read at an offset
+        raise OSError(errno.EINVAL, "not a regular file", fname)
+    src = open(fname, "rb", buffering=BLOCK_SIZE)
+
+    entry = lookup_cache(cache, fname, st) if cache else None
+    if encoding is None and entry and entry.get("encoding"):
+        encoding = entry["encoding"]
+    if encoding is not None:
+        future = concurrent.futures.Future()
+        future.set_result(encoding)
+    else:
+        future = _DETECT_EXECUTOR.submit(detect_file_encoding, src)
+    return src, future, entry
+
+
+def prompt_input_file(cache=None, encoding=None):
     """
     Prompt the user for an input filename. Validate errors and allow retry.
-    Returns (filename, encoding) if success, or exits if user chooses to quit.
+    Returns (filename, src, future, cache_entry) as described for open_input_file,
+    or exits if user chooses to quit.
     """
     while True:
         inp = input("Enter the path to the input file (or 'q' to quit): ").strip()
@@ -51,24 +293,10 @@ def prompt_input_file():
         # Expand user tilde and variables
         fname = os.path.expanduser(os.path.expandvars(inp))
 
-        # Basic existence checks
-        if not os.path.exists(fname):
-            print("Error: file not found. Please check the path and try again.")
-            continue
-        if os.path.isdir(fname):
-            print("Error: the path is a directory, not a file. Please provide a file.")
-            continue
-
-        # Try opening and detect encoding
         try:
-            enc = choose_encoding_try(fname)
-            return fname, enc
-        except UnicodeDecodeError:
-            print("Error: Could not decode file with standard encodings.")
-            # allow retry
-            r = input("Try again with a different file? (Y/n): ").strip().lower()
-            if r == "n":
-                sys.exit(1)
+            return (fname,) + open_input_file(fname, cache, encoding)
+        except FileNotFoundError:
+            print("Error: file not found. Please check the path and try again.")
             continue
         except PermissionError:
             print("Error: Permission denied when attempting to read the file.")
@@ -77,7 +305,7 @@ def prompt_input_file():
                 sys.exit(1)
             continue
         except IsADirectoryError:
-            print("Error: This is a directory, not a file.")
+            print("Error: the path is a directory, not a file. Please provide a file.")
             continue
         except Exception as e:
             # Catch-all for unexpected errors (report and offer retry)
@@ -98,7 +326,7 @@ def prompt_transformation():
     print("  3) Convert to lowercase")
     print("  4) Remove blank lines")
     print("  5) Replace text (provide target and replacement)")
-    print("  6) Reverse lines (write lines in reverse order)  -- NOTE: may load file into memory")
+    print("  6) Reverse lines (write lines in reverse order)")
     print("  7) No modification (copy as-is)")
 
     choice = input("Choice [1-7]: ").strip()
@@ -129,61 +357,176 @@ def make_output_filename(input_path):
     return suggested
 
 
-def transform_line_core(core_text, idx, opt):
+def replacement_pairs(opt):
     """
-    Apply transformation to a single line core (without trailing newline).
-    idx is 0-based line index for numbering.
-    Return the transformed core (string) or None if line should be skipped (e.g., remove blank).
+    Return the (target, replacement) pairs for choice 5: opt["replacements"] if
+    given, else the single opt["target"] / opt["replacement"] pair.
+    """
+    pairs = opt.get("replacements")
+    if pairs:
+        return list(pairs)
+    return [(opt.get("target", ""), opt.get("replacement", ""))]
+
+
+def compile_replacements(pairs):
+    """
+    Compile several (target, replacement) pairs (all str or all bytes) into one function
+    that replaces every target in a single pass over its argument, instead of one pass
+    per pair. Where targets overlap, the longest one wins.
+    """
+    table = dict(pairs)
+    targets = sorted(table, key=len, reverse=True)
+    sep = b"|" if isinstance(targets[0], bytes) else "|"
+    pattern = re.compile(sep.join(re.escape(t) for t in targets))
+    lookup = lambda m: table[m.group()]
+    return lambda text: pattern.sub(lookup, text)
+
+
+def build_transformer(opt):
+    """
+    Build the per-line transformation once, before the processing loop.
+    Returns a function (core_text, idx) -> transformed core (string) or None if the
+    line should be skipped, so the loop does no option lookups or choice comparisons.
+    If the function's preserves_newline attribute is True it gives the same result
+    when called on the raw line with its trailing newline, so callers may skip the
+    strip/re-append step.
     """
     choice = opt["choice"]
+    preserves_newline = True
     if choice == "1":
         # line numbers (padded)
-        return f"{idx+1:04d}: {core_text}"
-    if choice == "2":
-        return core_text.upper()
-    if choice == "3":
-        return core_text.lower()
-    if choice == "4":
-        # remove blank lines
-        if core_text.strip() == "":
-            return None
-        return core_text
-    if choice == "5":
-        return core_text.replace(opt.get("target", ""), opt.get("replacement", ""))
-    if choice == "6":
-        # reverse lines handled at write time (not here)
-        return core_text
-    if choice == "7":
-        return core_text
-    return core_text
+        transform = lambda core, idx: f"{idx+1:04d}: {core}"
+    elif choice == "2":
+        transform = lambda core, idx: core.upper()
+    elif choice == "3":
+        transform = lambda core, idx: core.lower()
+    elif choice == "4":
+        # remove blank lines (a lone newline strips to "" as well)
+        transform = lambda core, idx: None if core.strip() == "" else core
+    elif choice == "5":
+        pairs = replacement_pairs(opt)
+        if len(pairs) == 1:
+            target, replacement = pairs[0]
+            transform = lambda core, idx: core.replace(target, replacement)
+        else:
+            replace_all = compile_replacements(pairs)
+            transform = lambda core, idx: replace_all(core)
+        # an empty target, or one containing a line break, would also match around the line ending
+        preserves_newline = all(target != "" and "\n" not in target and "\r" not in target
+                                for target, _ in pairs)
+    else:
+        # 6 (reverse, handled at write time) and 7 (no modification)
+        transform = lambda core, idx: core
+    transform.preserves_newline = preserves_newline
+    return transform
 
 
-def process_streaming(input_path, encoding, opt, output_path):
+def sync_file(f):
     """
-    Process file line-by-line and write to a temporary file, then atomically move to output_path.
-    Returns tuple (lines_read, lines_written, output_path).
+    Flush f and force its contents to stable storage.
+    On macOS fsync only reaches the drive cache, so F_FULLFSYNC is tried first.
     """
-    lines_read = 0
-    lines_written = 0
+    f.flush()
+    if fcntl is not None and hasattr(fcntl, "F_FULLFSYNC"):
+        try:
+            fcntl.fcntl(f.fileno(), fcntl.F_FULLFSYNC)
+            return
+        except OSError:
+            pass
+    os.fsync(f.fileno())
 
-    # Use temporary file in same directory (safer for atomic replace across filesystems)
-    out_dir = os.path.dirname(output_path) or "."
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, dir=out_dir, encoding=encoding) as tmp:
+
+def sync_directory(path):
+    """
+    fsync a directory so a rename inside it survives a crash.
+    Skipped where directories cannot be opened (e.g. Windows).
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    dir_fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def open_o_tmpfile(dir_path):
+    """
+    Create an anonymous file in dir_path and return its descriptor.
+    The file has no name until linked, so it vanishes by itself when closed.
+    """
+    return os.open(dir_path, os.O_WRONLY | os.O_TMPFILE, 0o600)
+
+
+def link_o_tmpfile(fd, dir_path):
+    """
+    Give the anonymous file fd a fresh temporary name in dir_path and return it.
+    """
+    while True:
+        name = os.path.join(dir_path, f"tmp{os.urandom(6).hex()}")
+        try:
+            os.link(f"/proc/self/fd/{fd}", name)
+            return name
+        except FileExistsError:
+            continue
+
+
+def o_tmpfile_linkable(dir_path):
+    """
+    Check whether anonymous temp files can be created and linked by name in dir_path,
+    by trying it once with an empty file (whose name is removed again).
+    The answer is remembered per directory.
+    """
+    usable = _o_tmpfile_dirs.get(dir_path)
+    if usable is None:
+        usable = False
+        if _o_tmpfile_usable:
+            try:
+                fd = open_o_tmpfile(dir_path)
+            except OSError:
+                # e.g. filesystem without O_TMPFILE support
+                fd = None
+            if fd is not None:
+                try:
+                    # Linking through /proc can be refused (e.g. in some sandboxes)
+                    os.remove(link_o_tmpfile(fd, dir_path))
+                    usable = True
+                except OSError:
+                    pass
+                finally:
+                    os.close(fd)
+        _o_tmpfile_dirs[dir_path] = usable
+    return usable
+
+
+def write_temp_file(out_dir, write, mode="w", encoding=None, durable=False, newline=None):
+    """
+    Call write(tmp) with a new temporary file in out_dir, then return tuple
+    (tmp_name, result of write) once the file is complete.
+    On Linux the file is an anonymous O_TMPFILE inode that only gets a name after
+    the write succeeds, so a failed or interrupted run leaves nothing behind.
+    Elsewhere (or where o_tmpfile_linkable says linking is refused) a
+    NamedTemporaryFile is used and removed on failure.
+    With durable=True the data is fsynced before it is named. newline is passed to
+    the text file as for open().
+    """
+    if o_tmpfile_linkable(out_dir):
+        fd = open_o_tmpfile(out_dir)
+        with os.fdopen(fd, mode, encoding=encoding, buffering=BLOCK_SIZE, newline=newline) as tmp:
+            result = write(tmp)
+            if durable:
+                sync_file(tmp)
+            else:
+                tmp.flush()
+            return link_o_tmpfile(fd, out_dir), result
+
+    with tempfile.NamedTemporaryFile(mode=mode, delete=False, dir=out_dir, encoding=encoding,
+                                     buffering=BLOCK_SIZE, newline=newline) as tmp:
         tmp_name = tmp.name
         try:
-            with open(input_path, "r", encoding=encoding) as src:
-                for idx, raw_line in enumerate(src):
-                    lines_read += 1
-                    # Preserve trailing newline if present
-                    has_nl = raw_line.endswith("\n")
-                    core = raw_line.rstrip("\r\n")
-                    transformed = transform_line_core(core, idx, opt)
-                    if transformed is None:
-                        # e.g., blank-line removal
-                        continue
-                    out_line = transformed + ("\n" if has_nl else "")
-                    tmp.write(out_line)
-                    lines_written += 1
+            result = write(tmp)
+            if durable:
+                sync_file(tmp)
         except Exception:
             # Clean up temporary file on unexpected failure
             try:
@@ -192,11 +535,25 @@ def process_streaming(input_path, encoding, opt, output_path):
             except Exception:
                 pass
             raise
+    return tmp_name, result
+
 
-    # If output exists and is same path as tmp_name, handle overwrite; else replace
+def publish_temp_file(tmp_name, output_path, durable=False, if_exists="ask"):
+    """
+    Move a finished temporary file to output_path.
+    If output_path already exists, if_exists decides: "ask" the user, "overwrite"
+    silently, or "skip" (keep the existing file).
+    With durable=True the parent directory is fsynced after the rename
+    (the temp file itself must already be synced by the caller).
+    Returns the path actually written, or None if cancelled/skipped.
+    """
     try:
+        if if_exists == "skip" and os.path.exists(output_path):
+            os.remove(tmp_name)
+            print(f"Output file '{output_path}' already exists, not overwriting.")
+            return None
         # If output already exists, ask user whether to overwrite
-        if os.path.exists(output_path):
+        if if_exists == "ask" and os.path.exists(output_path):
             resp = input(f"Output file '{output_path}' already exists. Overwrite? (y/N): ").strip().lower()
             if resp != "y":
                 # ask for new name
@@ -204,114 +561,838 @@ def process_streaming(input_path, encoding, opt, output_path):
                 if new_name.lower() == "q":
                     os.remove(tmp_name)
                     print("Operation cancelled. Temporary file removed.")
-                    return lines_read, 0, None
+                    return None
                 output_path = os.path.expanduser(new_name)
 
         # atomic replace
         os.replace(tmp_name, output_path)
-    except Exception as e:
+    except Exception:
         # Cleanup temp file if replace failed
         try:
             os.remove(tmp_name)
         except Exception:
             pass
-        raise e
+        raise
 
-    return lines_read, lines_written, output_path
+    if durable:
+        sync_directory(os.path.dirname(output_path) or ".")
+    return output_path
 
 
-def process_reverse(input_path, encoding, opt, output_path):
+def copy_file_fast(src, dst):
     """
-    Reverse lines transformation requires loading lines in memory. Warn user.
+    Copy all bytes from binary file object src to dst.
+    Uses os.sendfile (in-kernel copy) where available, else shutil.copyfileobj.
     """
-    print("Warning: 'Reverse lines' will load the entire file into memory. Continue? (Y/n): ", end="")
-    c = input().strip().lower()
-    if c == "n":
-        print("Operation cancelled by user.")
-        return 0, 0, None
+    if hasattr(os, "sendfile"):
+        dst.flush()
+        in_fd, out_fd = src.fileno(), dst.fileno()
+        offset = 0
+        try:
+            while True:
+                sent = os.sendfile(out_fd, in_fd, offset, BLOCK_SIZE)
+                if sent == 0:
+                    return
+                offset += sent
+        except OSError:
+            # e.g. unsupported filesystem; fall back if nothing was copied yet
+            if offset != 0:
+                raise
+    shutil.copyfileobj(src, dst, BLOCK_SIZE)
+
+
+@contextlib.contextmanager
+def open_input(input_path, src=None):
+    """
+    Yield a binary reader positioned at the start of the input.
+    An already-open src is rewound and reused (and left open for its owner);
+    otherwise input_path is opened.
+    """
+    if src is None:
+        with open(input_path, "rb", buffering=BLOCK_SIZE) as f:
+            yield f
+    else:
+        src.seek(0)
+        yield src
+
+
+def process_copy(input_path, output_path, durable=False, src=None, if_exists="ask"):
+    """
+    Copy the file as-is (no modification) without decoding it.
+    src is an optional already-open binary handle on input_path; if_exists is passed
+    to publish_temp_file.
+    Lines are not counted, so returns tuple (None, None, output_path).
+    """
+    def write(tmp):
+        with open_input(input_path, src) as f:
+            copy_file_fast(f, tmp)
 
-    with open(input_path, "r", encoding=encoding) as src:
-        lines = src.readlines()
+    out_dir = os.path.dirname(output_path) or "."
+    tmp_name, _ = write_temp_file(out_dir, write, mode="wb", durable=durable)
+    return None, None, publish_temp_file(tmp_name, output_path, durable, if_exists)
+
+
+def make_block_transformer(opt, encoding):
+    """
+    Return a function (block, idx) -> bytes that transforms a block of complete lines,
+    where idx is the 0-based index of the block's first line, or None if this
+    choice/encoding combination has no binary fast path.
+    If the function's drops_lines attribute is True, output lines must be counted
+    from its result; otherwise every input line produces one output line.
+    Its cheap attribute is True if it runs at close to copying speed (for ASCII
+    input), so splitting it across worker processes does not pay off.
+    """
+    if encoding not in ASCII_COMPATIBLE_ENCODINGS:
+        return None
+
+    # The BOM (if any) is handled outside the blocks, so work with plain UTF-8
+    if encoding == "utf-8-sig":
+        encoding = "utf-8"
+
+    choice = opt["choice"]
+    if choice == "1":
+        add_numbers = lambda block, idx: number_lines(block, idx)
+        add_numbers.drops_lines = False
+        add_numbers.cheap = False
+        return add_numbers
+    if choice == "7":
+        copy = lambda block, idx: block
+        copy.drops_lines = False
+        copy.cheap = True
+        return copy
+    if choice in ("2", "3"):
+        table = _UPPER_TABLE if choice == "2" else _LOWER_TABLE
+        convert = str.upper if choice == "2" else str.lower
 
-    transformed_lines = []
-    for idx, raw_line in enumerate(lines):
-        core = raw_line.rstrip("\r\n")
-        has_nl = raw_line.endswith("\n")
-        t = transform_line_core(core, idx, opt)
-        if t is None:
+        def change_case(block, idx):
+            if block.isascii():
+                return block.translate(table)
+            # Non-ASCII text needs full Unicode case mapping
+            return convert(block.decode(encoding)).encode(encoding)
+        change_case.drops_lines = False
+        change_case.cheap = True
+        return change_case
+    if choice == "4":
+        def remove_blank(block, idx):
+            if block.isascii():
+                return _BLANK_LINE_BYTES.sub(b"", block)
+            # Non-ASCII text may contain Unicode whitespace
+            return _BLANK_LINE_TEXT.sub("", block.decode(encoding)).encode(encoding)
+        remove_blank.drops_lines = True
+        remove_blank.cheap = False
+        return remove_blank
+    if choice == "5":
+        pairs = replacement_pairs(opt)
+        # Empty targets and targets containing line breaks only make sense per line
+        if any(target == "" or "\n" in target or "\r" in target for target, _ in pairs):
+            return None
+        try:
+            pairs = [(target.encode(encoding), replacement.encode(encoding)) for target, replacement in pairs]
+        except UnicodeEncodeError:
+            return None
+        if len(pairs) == 1:
+            # a single literal is fastest with bytes.replace
+            target_b, replacement_b = pairs[0]
+            replace = lambda block, idx: block.replace(target_b, replacement_b)
+            replace.cheap = True
+        else:
+            replace_all = compile_replacements(pairs)
+            replace = lambda block, idx: replace_all(block)
+            replace.cheap = False
+        replace.drops_lines = False
+        return replace
+    return None
+
+
+def count_lines(block):
+    """
+    Count the lines in a block from iter_line_blocks (only the last block
+    of a file may end without a newline).
+    """
+    n = block.count(b"\n")
+    if block and not block.endswith(b"\n"):
+        n += 1
+    return n
+
+
+def number_lines(block, start_idx):
+    """
+    Prefix every line of a line-aligned block with its number ('0001: ').
+    start_idx is the 0-based index of the block's first line.
+    Output is appended to one bytearray per block with C-level bytes formatting,
+    so no per-line str or combined line object is created.
+    """
+    lines = block.split(b"\n")
+    tail = lines.pop()  # b"" when the block ends with a newline
+    out = bytearray()
+    n = start_idx
+    for line in lines:
+        n += 1
+        out += b"%04d: " % n
+        out += line
+        out.append(0x0a)
+    if tail:
+        # last line of the file, without a newline
+        out += b"%04d: " % (n + 1)
+        out += tail
+    return out
+
+
+def iter_line_blocks(src, block_size=BLOCK_SIZE, limit=None):
+    """
+    Read a binary file in large blocks and yield chunks that end on a newline.
+    Only the final chunk may lack a trailing newline, so lines (and multi-byte
+    characters) are never split across chunks.
+    If limit is given, at most that many bytes are read.
+    Only newly read bytes are searched, and the pieces of a long line are joined
+    once, so a line spanning many blocks costs linear time.
+    """
+    carry = []  # pieces of the current line, read since the last newline
+    while True:
+        size = block_size if limit is None else min(block_size, limit)
+        chunk = src.read(size) if size else b""
+        if not chunk:
+            break
+        if limit is not None:
+            limit -= len(chunk)
+        cut = chunk.rfind(b"\n") + 1
+        if cut == 0:
+            # no newline yet, keep accumulating the current line
+            carry.append(chunk)
             continue
-        transformed_lines.append(t + ("\n" if has_nl else ""))
+        if carry:
+            carry.append(chunk[:cut])
+            yield b"".join(carry)
+            carry.clear()
+        else:
+            yield chunk[:cut]
+        if cut < len(chunk):
+            carry.append(chunk[cut:])
+    if carry:
+        yield b"".join(carry)
 
-    # write to temp file and replace
+
+def iter_input_blocks(src, start=0, end=None):
+    """
+    Yield line-aligned blocks of binary file src from offset start up to end
+    (default: end of file).
+    """
+    src.seek(start)
+    yield from iter_line_blocks(src, limit=None if end is None else end - start)
+
+
+def transform_blocks(src, tmp, block_transform, bom=b""):
+    """
+    Apply block_transform to binary file src in line-aligned blocks, writing to binary file tmp.
+    A byte-order mark bom is kept out of the blocks and written first, as the text path does.
+    Returns tuple (lines_read, lines_written).
+    """
+    start = 0
+    if bom:
+        if src.read(len(bom)) == bom:
+            start = len(bom)
+        tmp.write(bom)
+    return transform_range(src, tmp, block_transform, start)
+
+
+def transform_range(src, tmp, block_transform, start=0, end=None, first_line=0):
+    """
+    Apply block_transform to bytes start..end of binary file src, writing to binary file tmp.
+    start must be at the beginning of a line; first_line is the 0-based index of that line.
+    Returns tuple (lines_read, lines_written) for the range.
+    Raises BareCarriageReturn if a block contains a CR line ending.
+    """
+    lines_read = 0
+    lines_written = 0
+    drops_lines = block_transform.drops_lines
+    for block in iter_input_blocks(src, start, end):
+        # blocks end on a line boundary, so no CRLF is split between two of them
+        if block_has_bare_cr(block):
+            raise BareCarriageReturn()
+        out = block_transform(block, first_line + lines_read)
+        lines_read += count_lines(block)
+        if drops_lines:
+            lines_written += count_lines(out)
+        tmp.write(out)
+    if not drops_lines:
+        lines_written = lines_read
+    return lines_read, lines_written
+
+
+# ---------- Parallel block path ----------
+def split_line_ranges(src, start, end, n):
+    """
+    Split bytes start..end of binary file src into at most n ranges of roughly
+    equal size, each ending just after a newline (the last one at end).
+    Returns a list of (start, end) tuples.
+    """
+    bounds = [start]
+    for i in range(1, n):
+        pos = start + (end - start) * i // n
+        if pos <= bounds[-1]:
+            # previous range already reaches past this point (very long line)
+            continue
+        # step back one byte so a cut point right after a newline is kept
+        src.seek(pos - 1)
+        src.readline()
+        pos = src.tell()
+        if pos >= end:
+            break
+        bounds.append(pos)
+    bounds.append(end)
+    return list(zip(bounds, bounds[1:]))
+
+
+def count_newlines(input_path, start, end):
+    """
+    Count the newline bytes between offsets start and end of input_path.
+    Runs in a worker process.
+    """
+    n = 0
+    with open(input_path, "rb", buffering=0) as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(BLOCK_SIZE, remaining))
+            if not chunk:
+                break
+            n += chunk.count(b"\n")
+            remaining -= len(chunk)
+    return n
+
+
+def transform_shard(input_path, start, end, first_line, opt, encoding, shard_path):
+    """
+    Transform bytes start..end of input_path into the file shard_path.
+    Runs in a worker process, so the block transformer is rebuilt here
+    (closures cannot be sent between processes).
+    Returns tuple (lines_read, lines_written) for the range.
+    """
+    block_transform = make_block_transformer(opt, encoding)
+    with open(input_path, "rb", buffering=BLOCK_SIZE) as src, \
+            open(shard_path, "wb", buffering=BLOCK_SIZE) as shard:
+        return transform_range(src, shard, block_transform, start, end, first_line)
+
+
+def usable_cpus():
+    """
+    Number of CPUs this process may run on (its affinity mask where supported).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def transform_parallel(src, tmp, input_path, out_dir, encoding, opt, bom=b"", n_workers=None):
+    """
+    Like transform_blocks, but split the input into newline-aligned byte ranges that
+    worker processes transform into shard files, in a scratch directory in out_dir.
+    Each finished shard is appended to tmp in order (in-kernel where possible) and
+    deleted at once, and the scratch directory is removed as a whole at the end.
+    For line numbering, the workers first count the lines of each range so every
+    shard knows the number of its first line.
+    Returns tuple (lines_read, lines_written).
+    """
+    if n_workers is None:
+        n_workers = usable_cpus()
+    size = os.fstat(src.fileno()).st_size
+    start = 0
+    if bom:
+        if src.read(len(bom)) == bom:
+            start = len(bom)
+        tmp.write(bom)
+    ranges = split_line_ranges(src, start, size, n_workers)
+
+    scratch = tempfile.mkdtemp(prefix=".shards", dir=out_dir)
+    try:
+        shards = [os.path.join(scratch, "%02d" % i) for i in range(len(ranges))]
+        # spawn, not fork: forking a process that has started threads is unsafe
+        with multiprocessing.get_context("spawn").Pool(len(ranges)) as pool:
+            if opt["choice"] == "1":
+                counts = pool.starmap(count_newlines, [(input_path, a, b) for a, b in ranges])
+                first_lines = list(itertools.accumulate([0] + counts[:-1]))
+            else:
+                first_lines = [0] * len(ranges)
+            pending = [
+                pool.apply_async(transform_shard, (input_path, a, b, first_line, opt, encoding, shard_path))
+                for (a, b), first_line, shard_path in zip(ranges, first_lines, shards)
+            ]
+            results = []
+            for shard_path, result in zip(shards, pending):
+                # append shards as they complete, so at most the unappended ones take extra space
+                results.append(result.get())
+                with open(shard_path, "rb") as shard:
+                    copy_file_fast(shard, tmp)
+                os.remove(shard_path)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return sum(r for r, _ in results), sum(w for _, w in results)
+
+
+def transform_lines(src, tmp, encoding, opt):
+    """
+    Decode binary file src and apply the chosen transformation line by line,
+    writing to text file tmp (opened with newline=""). Each line keeps its own
+    line ending (LF, CRLF or CR), as on the binary block path.
+    Returns tuple (lines_read, lines_written).
+    """
+    lines_read = 0
+    lines_written = 0
+    transform = build_transformer(opt)
+    keep_newline = transform.preserves_newline
+    # Batch many small lines into one large write
+    pending = []
+    pending_size = 0
+    text = io.TextIOWrapper(src, encoding=encoding, newline="")
+    try:
+        for idx, raw_line in enumerate(text):
+            lines_read += 1
+            if keep_newline:
+                # transform the raw line directly, no strip/re-append
+                out_line = transform(raw_line, idx)
+                if out_line is None:
+                    continue
+            else:
+                # Preserve the original line ending if present
+                core = raw_line.rstrip("\r\n")
+                transformed = transform(core, idx)
+                if transformed is None:
+                    # e.g., blank-line removal
+                    continue
+                out_line = transformed + raw_line[len(core):]
+            pending.append(out_line)
+            pending_size += len(out_line)
+            if pending_size >= WRITE_BATCH_SIZE:
+                tmp.write("".join(pending))
+                pending.clear()
+                pending_size = 0
+            lines_written += 1
+    finally:
+        # leave src open for its owner
+        text.detach()
+    if pending:
+        tmp.write("".join(pending))
+    return lines_read, lines_written
+
+
+def process_streaming(input_path, encoding, opt, output_path, durable=False, src=None, if_exists="ask",
+                      parallel=True):
+    """
+    Process file line-by-line and write to a temporary file, then atomically move to output_path.
+    src is an optional already-open binary handle on input_path; if_exists is passed
+    to publish_temp_file.
+    With durable=True the data is fsynced before the rename. With parallel=False very
+    large inputs are not split across worker processes (for batch runs, which may
+    already run many at once).
+    Files with CR line endings are processed on the text path: the block path is
+    skipped if the probe shows one, and abandoned if a later block does.
+    Returns tuple (lines_read, lines_written, output_path).
+    """
+    block_transform = make_block_transformer(opt, encoding)
+    if block_transform is not None:
+        with open_input(input_path, src) as f:
+            if has_bare_cr(read_head(f)):
+                # the blocks are split on LF only; CR line endings need the text path
+                block_transform = None
+    bom = codecs.BOM_UTF8 if encoding == "utf-8-sig" else b""
+    # Use temporary file in same directory (safer for atomic replace across filesystems)
     out_dir = os.path.dirname(output_path) or "."
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, dir=out_dir, encoding=encoding) as tmp:
-        tmp_name = tmp.name
-        tmp.writelines(reversed(transformed_lines))
 
+    def write(tmp):
+        with open_input(input_path, src) as f:
+            if block_transform is not None:
+                n_workers = usable_cpus() if parallel and not block_transform.cheap else 1
+                if n_workers > 1 and os.fstat(f.fileno()).st_size >= PARALLEL_THRESHOLD:
+                    # Very large input with CPU-heavy blocks: spread them over all cores
+                    return transform_parallel(f, tmp, input_path, out_dir, encoding, opt, bom, n_workers)
+                # Fast path: raw bytes in large blocks, no per-line decode/encode
+                return transform_blocks(f, tmp, block_transform, bom)
+            return transform_lines(f, tmp, encoding, opt)
+
+    tmp_name = None
+    if block_transform is not None:
+        try:
+            tmp_name, (lines_read, lines_written) = write_temp_file(out_dir, write, "wb", None, durable)
+        except BareCarriageReturn:
+            # the partial temporary file is already gone; start again on the text path
+            block_transform = None
+    if tmp_name is None:
+        tmp_name, (lines_read, lines_written) = write_temp_file(out_dir, write, "w", encoding, durable,
+                                                                newline="")
+
+    output_path = publish_temp_file(tmp_name, output_path, durable, if_exists)
+    if output_path is None:
+        return lines_read, 0, None
+    return lines_read, lines_written, output_path
+
+
+def write_batched(tmp, lines, empty):
+    """
+    Write an iterable of lines to tmp as joined batches of about WRITE_BATCH_SIZE,
+    instead of one write call per line. empty is "" for text or b"" for binary files.
+    Returns the number of lines written.
+    """
+    count = 0
+    pending = []
+    pending_size = 0
+    for line in lines:
+        count += 1
+        pending.append(line)
+        pending_size += len(line)
+        if pending_size >= WRITE_BATCH_SIZE:
+            tmp.write(empty.join(pending))
+            pending.clear()
+            pending_size = 0
+    if pending:
+        tmp.write(empty.join(pending))
+    return count
+
+
+def iter_lines_reversed(src, block_size=BLOCK_SIZE, start=0):
+    """
+    Yield the lines of binary file src from last to first, reading fixed-size
+    blocks backwards from the end down to offset start. Each line keeps its
+    trailing newline (if any). Lines are split on LF only, so BareCarriageReturn
+    is raised if a CR line ending is found.
+    Memory use is bounded by block_size plus the longest line, and only newly read
+    blocks are searched, so a line spanning many blocks costs linear time.
+    """
+    pos = src.seek(0, os.SEEK_END)
+    # pieces of the file-earliest line seen so far (may be incomplete), last piece first
+    carry = []
+    next_byte = b""  # first byte of the block read before (later in the file)
+    while pos > start:
+        take = min(block_size, pos - start)
+        pos -= take
+        src.seek(pos)
+        buf = src.read(take)
+        if block_has_bare_cr(buf, next_byte):
+            raise BareCarriageReturn()
+        next_byte = buf[:1]
+        end = len(buf)
+        if carry:
+            # the newline that completes the carried line may be anywhere in buf
+            nl = buf.rfind(b"\n")
+            if nl < 0:
+                carry.append(buf)
+                continue
+            carry.append(buf[nl + 1:])
+            yield b"".join(reversed(carry))
+            carry.clear()
+            end = nl + 1
+        while True:
+            # newline that ends the previous line (ignore the one ending this line)
+            nl = buf.rfind(b"\n", 0, end - 1)
+            if nl < 0:
+                break
+            yield buf[nl + 1:end]
+            end = nl + 1
+        if end:
+            carry.append(buf[:end])
+    if carry:
+        yield b"".join(reversed(carry))
+
+
+def process_reverse(input_path, encoding, opt, output_path, durable=False, src=None, if_exists="ask",
+                    interactive=True):
+    """
+    Write the lines of the file in reverse order.
+    The file is read backwards in blocks, so it is never loaded into memory as a whole;
+    files with CR line endings fall back to process_reverse_in_memory.
+    src is an optional already-open binary handle on input_path; if_exists is passed
+    to publish_temp_file. interactive=False (batch runs) skips the confirmation the
+    in-memory fallback asks for.
+    Returns tuple (lines_read, lines_written, output_path).
+    """
+    with open_input(input_path, src) as f:
+        bare_cr = has_bare_cr(read_head(f))
+    if encoding not in ASCII_COMPATIBLE_ENCODINGS or bare_cr:
+        return process_reverse_in_memory(input_path, encoding, opt, output_path, durable, src, if_exists,
+                                         interactive)
+
+    def write(tmp):
+        # Reversing does not change line contents, so raw bytes are moved as-is
+        start = 0
+        if encoding == "utf-8-sig":
+            # keep the BOM at the start of the output, not at the end
+            tmp.write(codecs.BOM_UTF8)
+            start = len(codecs.BOM_UTF8)
+        with open_input(input_path, src) as f:
+            return write_batched(tmp, iter_lines_reversed(f, start=start), b"")
+
+    out_dir = os.path.dirname(output_path) or "."
     try:
-        if os.path.exists(output_path):
-            resp = input(f"Output file '{output_path}' already exists. Overwrite? (y/N): ").strip().lower()
-            if resp != "y":
-                new_name = input("Enter a new output filename (or 'q' to cancel): ").strip()
-                if new_name.lower() == "q":
-                    os.remove(tmp_name)
-                    print("Operation cancelled. Temporary file removed.")
-                    return 0, 0, None
-                output_path = os.path.expanduser(new_name)
-        os.replace(tmp_name, output_path)
-    except Exception:
+        tmp_name, lines = write_temp_file(out_dir, write, mode="wb", durable=durable)
+    except BareCarriageReturn:
+        # found past the probe; the partial temporary file is already gone
+        return process_reverse_in_memory(input_path, encoding, opt, output_path, durable, src, if_exists,
+                                         interactive)
+
+    output_path = publish_temp_file(tmp_name, output_path, durable, if_exists)
+    if output_path is None:
+        return 0, 0, None
+    return lines, lines, output_path
+
+
+def process_reverse_in_memory(input_path, encoding, opt, output_path, durable=False, src=None, if_exists="ask",
+                              interactive=True):
+    """
+    Reverse lines by loading them in memory. Only used for encodings where
+    newlines cannot be found by scanning raw bytes (e.g. UTF-16), and for files
+    with bare CR line endings, which the backward reader does not split on. Warn user
+    and ask to continue, unless interactive is False.
+    """
+    if interactive:
+        print("Warning: 'Reverse lines' will load the entire file into memory. Continue? (Y/n): ", end="")
+        c = input().strip().lower()
+        if c == "n":
+            print("Operation cancelled by user.")
+            return 0, 0, None
+
+    transform = build_transformer(opt)
+    keep_newline = transform.preserves_newline
+    lines_read = 0
+    w = 0
+    with open_input(input_path, src) as f:
+        # Pre-size the result list from a rough estimate (~50 bytes per line) and fill
+        # it by index; the source lines themselves are never kept in a list
+        transformed_lines = [None] * (os.fstat(f.fileno()).st_size // 50)
+        # newline="" keeps each line's own ending, as the backward block reader does
+        text = io.TextIOWrapper(f, encoding=encoding, newline="")
         try:
-            os.remove(tmp_name)
-        except Exception:
-            pass
-        raise
+            for idx, raw_line in enumerate(text):
+                lines_read += 1
+                if keep_newline:
+                    t = transform(raw_line, idx)
+                    if t is None:
+                        continue
+                else:
+                    core = raw_line.rstrip("\r\n")
+                    t = transform(core, idx)
+                    if t is None:
+                        continue
+                    t += raw_line[len(core):]
+                if w < len(transformed_lines):
+                    transformed_lines[w] = t
+                else:
+                    transformed_lines.append(t)
+                w += 1
+        finally:
+            # leave f open for its owner
+            text.detach()
+    del transformed_lines[w:]
+
+    # write to temp file and replace
+    out_dir = os.path.dirname(output_path) or "."
+    tmp_name, _ = write_temp_file(out_dir, lambda tmp: write_batched(tmp, reversed(transformed_lines), ""),
+                                  "w", encoding, durable, newline="")
 
-    return len(lines), len(transformed_lines), output_path
+    output_path = publish_temp_file(tmp_name, output_path, durable, if_exists)
+    if output_path is None:
+        return 0, 0, None
+
+    return lines_read, len(transformed_lines), output_path
 
 
 # ---------- Main ----------
 
+def normalize_encoding(name):
+    """
+    Return the canonical spelling of encoding name, preferring the names used by
+    detection (so e.g. "UTF8" and "iso-8859-1" still get the byte-level fast paths).
+    Raises LookupError for unknown encodings.
+    """
+    canonical = codecs.lookup(name).name
+    for known in ASCII_COMPATIBLE_ENCODINGS:
+        if codecs.lookup(known).name == canonical:
+            return known
+    return canonical
+
+
+def parse_args(argv=None):
+    """
+    Parse command-line options. Anything given here is not asked interactively;
+    with both --input and --choice the program runs without prompts (apart from an
+    existing output file, unless --force or --no-clobber is given).
+    """
+    parser = argparse.ArgumentParser(description="Read a file, apply a modification, and write a modified copy.")
+    parser.add_argument("--input", help="input file (skips the input prompt)")
+    parser.add_argument("--output", help="output file (skips the output prompt)")
+    parser.add_argument("--choice", choices=[str(i) for i in range(1, 8)],
+                        help="transformation number as listed in the menu (skips the menu)")
+    parser.add_argument("--target", action="append",
+                        help="text to replace with --choice 5; repeat for several replacements in one pass")
+    parser.add_argument("--replacement", action="append", help="replacement text, one per --target")
+    parser.add_argument("--encoding", help="input encoding (skips detection)")
+    overwrite = parser.add_mutually_exclusive_group()
+    overwrite.add_argument("--force", action="store_true",
+                           help="overwrite an existing output file without asking")
+    overwrite.add_argument("--no-clobber", action="store_true", help="never overwrite an existing output file")
+    parser.add_argument("--durable", action="store_true",
+                        help="fsync the output file and its directory so the result survives a crash")
+    args = parser.parse_args(argv)
+
+    if args.choice == "5":
+        if not args.target:
+            parser.error("--choice 5 requires --target")
+        if len(args.replacement or []) != len(args.target):
+            parser.error("give one --replacement per --target")
+    elif args.target or args.replacement:
+        parser.error("--target and --replacement only apply to --choice 5")
+    if args.encoding:
+        try:
+            args.encoding = normalize_encoding(args.encoding)
+        except LookupError:
+            parser.error(f"unknown encoding: {args.encoding}")
+    return args
+
+
+def options_from_args(args):
+    """
+    Build the transformation options (as returned by prompt_transformation) from --choice.
+    """
+    opt = {"choice": args.choice}
+    if args.choice == "5":
+        pairs = list(zip(args.target, args.replacement))
+        opt["target"], opt["replacement"] = pairs[0]
+        if len(pairs) > 1:
+            opt["replacements"] = pairs
+    return opt
+
+
 def main():
-    print("File Read & Write Challenge + Error Handling Lab")
-    print("This program reads a file, applies a chosen modification, and writes a modified copy.\n")
+    args = parse_args()
+    batch = args.input is not None and args.choice is not None
+    if args.force:
+        if_exists = "overwrite"
+    elif args.no_clobber:
+        if_exists = "skip"
+    else:
+        if_exists = "ask"
 
-    # 1) Ask user for input file with validation
-    input_path, encoding = prompt_input_file()
-    print(f"Detected/selected encoding: {encoding}")
+    if not batch:
+        print("File Read & Write Challenge + Error Handling Lab")
+        print("This program reads a file, applies a chosen modification, and writes a modified copy.\n")
 
-    # 2) Ask user for transformation
-    opt = prompt_transformation()
+    cache = load_cache()
+    while True:
+        # 1) Input file from --input, or ask user with validation
+        if args.input is not None:
+            input_path = os.path.expanduser(args.input)
+            try:
+                src, encoding_future, cache_entry = open_input_file(input_path, cache, args.encoding)
+            except OSError as e:
+                print(f"Error: cannot read input file '{input_path}': {e.strerror or e}")
+                sys.exit(1)
+        else:
+            input_path, src, encoding_future, cache_entry = prompt_input_file(cache, args.encoding)
 
-    # 3) Suggest output filename and confirm
-    suggested_output = make_output_filename(input_path)
-    print(f"Suggested output filename: {suggested_output}")
-    out = input(f"Press Enter to accept or type a new output path: ").strip()
-    output_path = suggested_output if out == "" else os.path.expanduser(out)
+        # 2) Transformation from --choice, or ask user
+        opt = options_from_args(args) if args.choice else prompt_transformation()
 
-    # 4) Perform processing (choose streaming or reverse)
-    try:
-        if opt["choice"] == "6":  # reverse
-            lines_read, lines_written, written_path = process_reverse(input_path, encoding, opt, output_path)
+        # A plain copy never decodes the file, so skip encoding detection
+        if opt["choice"] == "7":
+            encoding_future.cancel()
+            concurrent.futures.wait([encoding_future])
+            encoding = None
+            break
+        try:
+            encoding = encoding_future.result()
+            if not batch:
+                print(f"Detected/selected encoding: {encoding}")
+            break
+        except UnicodeDecodeError:
+            src.close()
+            print("Error: Could not decode file with standard encodings.")
+            if args.input is not None:
+                sys.exit(1)
+            # allow retry
+            r = input("Try again with a different file? (Y/n): ").strip().lower()
+            if r == "n":
+                sys.exit(1)
+        except PermissionError:
+            src.close()
+            print("Error: Permission denied when attempting to read the file.")
+            if args.input is not None:
+                sys.exit(1)
+            r = input("Choose another file? (Y/n): ").strip().lower()
+            if r == "n":
+                sys.exit(1)
+        except Exception as e:
+            # Catch-all for other errors while detecting (report and offer retry)
+            src.close()
+            print(f"Unexpected error while checking file: {e}")
+            if args.input is not None:
+                sys.exit(1)
+            r = input("Try again? (Y/n): ").strip().lower()
+            if r == "n":
+                sys.exit(1)
+
+    # 3) Output from --output; batch runs use the default name (never cached state),
+    #    interactive runs suggest the last one used for this file, if any, and confirm
+    if args.output is not None:
+        output_path = os.path.expanduser(args.output)
+    elif batch:
+        output_path = make_output_filename(input_path)
+    else:
+        if cache_entry and cache_entry.get("last_out"):
+            suggested_output = cache_entry["last_out"]
         else:
-            lines_read, lines_written, written_path = process_streaming(input_path, encoding, opt, output_path)
+            suggested_output = make_output_filename(input_path)
+        print(f"Suggested output filename: {suggested_output}")
+        out = input(f"Press Enter to accept or type a new output path: ").strip()
+        output_path = suggested_output if out == "" else os.path.expanduser(out)
+
+    if if_exists == "skip" and os.path.exists(output_path):
+        # don't do the work only to throw it away
+        src.close()
+        print(f"Output file '{output_path}' already exists, not overwriting.")
+        return
+
+    # 4) Perform processing (choose copy, streaming or reverse), reusing the open input
+    try:
+        with src:
+            if opt["choice"] == "7":  # copy as-is
+                lines_read, lines_written, written_path = process_copy(input_path, output_path, args.durable, src,
+                                                                       if_exists)
+            elif opt["choice"] == "6":  # reverse
+                lines_read, lines_written, written_path = process_reverse(input_path, encoding, opt, output_path,
+                                                                          args.durable, src, if_exists,
+                                                                          interactive=not batch)
+            else:
+                lines_read, lines_written, written_path = process_streaming(input_path, encoding, opt, output_path,
+                                                                            args.durable, src, if_exists,
+                                                                            parallel=not batch)
+            input_stat = os.fstat(src.fileno())
 
         if written_path is None:
             print("No output written (operation cancelled).")
         else:
-            print("\nDone.")
-            print(f"Input file: {input_path}")
+            if not batch:
+                print("\nDone.")
+                print(f"Input file: {input_path}")
             print(f"Output file: {written_path}")
-            print(f"Lines read: {lines_read}")
-            print(f"Lines written: {lines_written}")
+            if lines_read is not None:
+                print(f"Lines read: {lines_read}")
+                print(f"Lines written: {lines_written}")
+            if not batch:
+                # batch runs leave the cache alone, so parallel jobs never race on rewriting it;
+                # only a detected encoding is remembered, not one forced with --encoding
+                update_cache(cache, input_path, input_stat, None if args.encoding else encoding, written_path)
+                save_cache(cache)
 
     except FileNotFoundError:
         print("Error: input file disappeared during processing.")
+        sys.exit(1)
     except PermissionError:
         print("Error: Permission denied while reading/writing files. Check file permissions.")
+        sys.exit(1)
     except UnicodeDecodeError:
         print("Error: File encoding not supported or file is binary. Try a different encoding or file.")
+        sys.exit(1)
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":